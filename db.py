@@ -1,51 +1,160 @@
+import struct
+
 import tornado.gen
-import motor
+
+from startup import lazy_import
+
+bson = lazy_import("bson")
+raw_bson = lazy_import("bson.raw_bson")
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+
+
+def _read_preference_key(read_preference):
+    return repr(read_preference) if read_preference is not None else None
+
+
+def _raw_id(document):
+    """Return the _id of a RawBSONDocument, reading it from the bytes.
+
+    The server stores _id as the first field. Other layouts and uncommon _id types fall back
+    to document.get("_id"), which decodes the whole document.
+    """
+    data = document.raw
+    element_type = data[4]
+    name_end = data.index(b"\x00", 5)
+    if data[5:name_end] == b"_id":
+        position = name_end + 1
+        if element_type == 0x02:
+            length = _INT32.unpack_from(data, position)[0]
+            return data[position + 4:position + 3 + length].decode("utf-8")
+        if element_type == 0x07:
+            return bson.ObjectId(data[position:position + 12])
+        if element_type == 0x10:
+            return _INT32.unpack_from(data, position)[0]
+        if element_type == 0x12:
+            return _INT64.unpack_from(data, position)[0]
+    return document.get("_id")
+
 
 class DB(object):
 
-    def __init__(self, db):
+    def __init__(self, db, collection_options=None, read_preference=None, pool_stats=None):
+        """
+        db                      the motor database
+        collection_options      dictionary of collection name -> options used for that
+                                collection. Options are passed to with_options, e.g.
+                                codec_options, read_preference, read_concern, write_concern
+        read_preference         default read preference for the read-only methods
+                                (query_*, get_documents, count_documents, aggregate*).
+                                Collection options and per call read_preference take
+                                precedence. (default : None, reads go to the primary)
+        pool_stats              pool_stats.PoolStatsListener registered on the motor client
+        """
         self.db = db
+        self.collection_options = dict(collection_options or {})
+        self.read_preference = read_preference
+        self.pool_stats = pool_stats
+        self._collections = {}
+        # cache keys of the read preferences, computed once instead of on every read
+        self._read_preference_key = _read_preference_key(read_preference)
+        self._collections_with_read_preference = {name for name, options in self.collection_options.items()
+                if "read_preference" in options}
+
+    #################### Collections #####################
+    def configure_collection(self, collection_name, **options):
+        """Set the options of a collection, replacing its cached handles"""
+        self.collection_options[collection_name] = options
+        if "read_preference" in options:
+            self._collections_with_read_preference.add(collection_name)
+        else:
+            self._collections_with_read_preference.discard(collection_name)
+        for key in [key for key in self._collections if key[0] == collection_name]:
+            del self._collections[key]
+
+    def collection(self, collection_name, read_preference=None, raw=False):
+        """Return the cached collection handle.
+
+        read_preference         override the read preference of the collection
+        raw                     if true, documents are returned as RawBSONDocument
+                                (undecoded bson, see BaseHandler.write_raw_json).
+                                Note that .get() or [] on a RawBSONDocument decodes the
+                                whole document and keeps the decoded copy on it.
+        """
+        return self._collection(collection_name, read_preference, _read_preference_key(read_preference), raw)
+
+    def _collection(self, collection_name, read_preference, read_preference_key, raw):
+        key = (collection_name, read_preference_key, raw)
+        collection = self._collections.get(key)
+        if collection is None:
+            options = dict(self.collection_options.get(collection_name, {}))
+            if read_preference is not None:
+                options["read_preference"] = read_preference
+            collection = self.db[collection_name]
+            if raw:
+                # keep the client codec options (tz_aware, uuid representation, ...)
+                codec_options = options.get("codec_options", collection.codec_options)
+                options["codec_options"] = codec_options.with_options(document_class=raw_bson.RawBSONDocument)
+            if options:
+                collection = collection.with_options(**options)
+            self._collections[key] = collection
+        return collection
+
+    def read_collection(self, collection_name, read_preference=None, raw=False):
+        """Return the collection handle for read-only methods"""
+        if read_preference is not None:
+            return self.collection(collection_name, read_preference=read_preference, raw=raw)
+        if collection_name in self._collections_with_read_preference:
+            return self._collection(collection_name, None, None, raw)
+        return self._collection(collection_name, self.read_preference, self._read_preference_key, raw)
+
+    def get_pool_stats(self):
+        """Return the connection pool statistics, see pool_stats.PoolStatsListener.snapshot"""
+        if self.pool_stats is None:
+            return {}
+        return self.pool_stats.snapshot()
 
     #################### Single document #####################
     @tornado.gen.coroutine
-    def get_document(self, collection_name, id):
-        data = yield self.query_one(collection_name, {"_id" : id})
+    def get_document(self, collection_name, id, read_preference=None, raw=False):
+        data = yield self.query_one(collection_name, {"_id" : id}, read_preference=read_preference, raw=raw)
         return data
 
     @tornado.gen.coroutine
     def has_document(self, collection_name, id):
-        count = yield self.db[collection_name].find({"_id" : id}).count()
+        count = yield self.collection(collection_name).find({"_id" : id}).count()
         return count > 0
 
     @tornado.gen.coroutine
     def insert_document(self, collection_name, data):
-        result = yield self.db[collection_name].save(data)
+        result = yield self.collection(collection_name).save(data)
         return result
 
     @tornado.gen.coroutine
     def save_document(self, collection_name, data):
-        result = yield self.db[collection_name].save(data)
+        result = yield self.collection(collection_name).save(data)
         return result
 
     @tornado.gen.coroutine
     def update_document(self, collection_name, id, changes):
-        result = yield self.db[collection_name].update({"_id":id}, {"$set" : changes })
+        result = yield self.collection(collection_name).update({"_id":id}, {"$set" : changes })
         return result
 
     @tornado.gen.coroutine
-    def query_one(self, collection_name, query):
-        data = yield self.db[collection_name].find_one(query)
+    def query_one(self, collection_name, query, read_preference=None, raw=False):
+        data = yield self.read_collection(collection_name, read_preference, raw).find_one(query)
         return data
 
     @tornado.gen.coroutine
     def remove_by_query(self, collection_name, query):
-        result = yield self.db[collection_name].remove(query)
+        result = yield self.collection(collection_name).remove(query)
         return result
 
     #################### Multiple Document ####################
     @tornado.gen.coroutine
-    def query_ids(self, collection_name, query, sort=None, pagination=None):
-        ids_cursor = self.db[collection_name].find(query, {"_id" : 1})
+    def query_ids(self, collection_name, query, sort=None, pagination=None, read_preference=None):
+        ids_cursor = self.read_collection(collection_name, read_preference).find(query, {"_id" : 1})
         if sort is not None and sort.get("by") is not None:
             if sort["by"] == "updated":
                 ids_cursor.sort([("updated_at", sort["order"])])
@@ -73,39 +182,40 @@ class DB(object):
 
     @tornado.gen.coroutine
     def has_documents(self, collection_name, ids):
-        count = yield self.db[collection_name].find({"_id" : { "$in" : ids }}).count()
+        count = yield self.collection(collection_name).find({"_id" : { "$in" : ids }}).count()
         return count == len(ids)
 
     @tornado.gen.coroutine
-    def get_documents(self, collection_name, ids, field=None):
-        cursor = self.db[collection_name].find({"_id" : { "$in" : ids } }, field)
+    def get_documents(self, collection_name, ids, field=None, read_preference=None, raw=False):
+        cursor = self.read_collection(collection_name, read_preference, raw).find({"_id" : { "$in" : ids } }, field)
         documents = {}
         while (yield cursor.fetch_next):
             obj = cursor.next_object()
-            documents[obj.get("_id")] = obj
+            documents[_raw_id(obj) if raw else obj.get("_id")] = obj
         return documents
 
     @tornado.gen.coroutine
-    def count_documents(self, collection_name, query):
-        cursor = self.db[collection_name].find(query)
+    def count_documents(self, collection_name, query, read_preference=None):
+        cursor = self.read_collection(collection_name, read_preference).find(query)
         count = yield cursor.count()
         return count
 
     @tornado.gen.coroutine
     def update_documents(self, collection_name, query, changes):
-        result = yield self.db[collection_name].update(query, {"$set" : changes}, multi=True)
+        result = yield self.collection(collection_name).update(query, {"$set" : changes}, multi=True)
         return result
 
     @tornado.gen.coroutine
     def delete_documents(self, collection_name, query):
-        result = yield self.db[collection_name].remove(query)
+        result = yield self.collection(collection_name).remove(query)
         return result
 
     @tornado.gen.coroutine
-    def query_via_cursor(self, collection_name, query, sort=None, pagination=None, return_count=False):
+    def query_via_cursor(self, collection_name, query, sort=None, pagination=None, return_count=False,
+            read_preference=None, raw=False):
         pagination = pagination or {}
 
-        cursor = self.db[collection_name].find(query)
+        cursor = self.read_collection(collection_name, read_preference, raw).find(query)
         if return_count:
             count = yield cursor.count()
         if sort:
@@ -138,7 +248,8 @@ class DB(object):
             raise tornado.gen.Return({"data":result, "count":count})
 
     @tornado.gen.coroutine
-    def aggregate_ids_by_one_field(self, collection_name, query, aggregate_field, count_only=False):
+    def aggregate_ids_by_one_field(self, collection_name, query, aggregate_field, count_only=False,
+            read_preference=None):
         """Aggregate all the object in this collection that match the query, grouping them by aggregate_field
 
         Return a list of aggregation
@@ -157,7 +268,8 @@ class DB(object):
                 { "$project" : { "_id" : 1, aggregate_field : 1 } },
                 { "$group" : { "_id" : "${0}".format(aggregate_field), "data" : { "$sum" : 1 } } }
             ]
-        aggregation_result = yield self.db[collection_name].aggregate(aggregation, cursor={"batchSize": 100})
+        collection = self.read_collection(collection_name, read_preference)
+        aggregation_result = yield collection.aggregate(aggregation, cursor={"batchSize": 100})
         result = []
         while (yield aggregation_result.fetch_next):
             item = aggregation_result.next_object()
@@ -165,8 +277,9 @@ class DB(object):
         return result
 
     @tornado.gen.coroutine
-    def aggregate(self, collection_name, aggregation):
-        aggregation_result = yield self.db[collection_name].aggregate(aggregation, cursor={})
+    def aggregate(self, collection_name, aggregation, read_preference=None, raw=False):
+        collection = self.read_collection(collection_name, read_preference, raw)
+        aggregation_result = yield collection.aggregate(aggregation, cursor={})
         result = []
         while (yield aggregation_result.fetch_next):
             item = aggregation_result.next_object()
@@ -1,9 +1,11 @@
-import arrow
-import shortuuid
-
 from dd.defined_dict import *
 from dd.dd_cleaner import *
 
+from startup import lazy_import
+
+arrow = lazy_import("arrow")
+shortuuid = lazy_import("shortuuid")
+
 ########################
 ##### BASE ###########
 ########################
@@ -59,6 +61,38 @@ class MapToMongoMixin(Mixin):
                     if isinstance(definition, DateTimeField):
                         document[key] = microsecond_to_datetime(document[key])
 
+    @classmethod
+    def from_mongo_plan(cls):
+        """Return the mapping used by map_from_mongo as a plan that can be applied while
+        reading bson, without decoding the document first (see RawBsonJsonEncoder)
+
+        { <store field> : (<key>, <convert function or None>, <plan of the inner document or None>) }
+
+        The convert function is applied on each value of a list.
+        """
+        plan = _FROM_MONGO_PLANS.get(cls)
+        if plan is not None:
+            return plan
+        plan = _FROM_MONGO_PLANS[cls] = {}  # registered first for models that refer to themselves
+        for key, definition in cls._fields.items():
+            store_field = getattr(definition, "store_field", None) or key
+            convert = None
+            inner_plan = None
+            if isinstance(definition, DefinedDictField) and issubclass(definition.model, MapToMongoMixin):
+                inner_plan = definition.model.from_mongo_plan()
+            elif isinstance(definition, ListField) and isinstance(definition.inner_type, DefinedDictField):
+                inner_plan = definition.inner_type.model.from_mongo_plan()
+            elif isinstance(definition, DateTimeField):
+                convert = microsecond_to_datetime
+            elif getattr(definition, "reversed_choices", None) is not None:
+                convert = definition.reversed_choices.get
+            if store_field != key or convert is not None or inner_plan is not None:
+                plan[store_field] = (key, convert, inner_plan)
+        return plan
+
+
+_FROM_MONGO_PLANS = {}
+
 
 class BaseDocument(DefinedDict, MapToMongoMixin, CleanerMixin):
     pass
@@ -1,22 +1,121 @@
 
 import os
+import re
 import sys
+import keyword
 import logging
 from tornado.options import OptionParser, Error
+from tornado.util import exec_in
+from tornado.escape import native_str
+
+from startup import startup_timer
+
+# Precedence of the option sources, higher wins whatever the parse order
+SOURCE_CONFIG_FILE = 1
+SOURCE_ENV_VAR = 2
+SOURCE_COMMAND_LINE = 3
+
+
+class OptionsSnapshot(object):
+    """Read-only copy of the option values, with plain slot attribute access.
+
+    Each parser builds a subclass with one slot per option, named by snapshot_attribute.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("OptionsSnapshot is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("OptionsSnapshot is read-only")
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__,
+                ", ".join("{0}={1!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+
+def snapshot_attribute(name):
+    """Return the OptionsSnapshot attribute of the option name.
+
+    Characters that are not valid in an identifier are replaced by "_", names starting with
+    a digit are prefixed with "_" and keywords are suffixed with "_",
+    e.g. "db.host" -> "db_host", "log-level" -> "log_level", "class" -> "class_"
+    """
+    attribute = re.sub(r"\W", "_", name)
+    if not attribute or attribute[0].isdigit():
+        attribute = "_" + attribute
+    if keyword.iskeyword(attribute):
+        attribute += "_"
+    return attribute
+
 
 class CustomOptionParser(OptionParser):
 
-    def __init__(self, check_validity=True, **kwargs):
+    def __init__(self, check_validity=True, timer=None, **kwargs):
+        """
+        check_validity          run is_valid_config after parsing
+        timer                   the StartupTimer recording the parse phases
+                                (default : startup.startup_timer)
+        """
         super().__init__(**kwargs)
+        self.__dict__["_timer"] = timer or startup_timer
+        self.__dict__["_option_sources"] = {}
+        self.__dict__["_snapshot"] = None
         if check_validity:
             self.add_parse_callback(lambda: self.is_valid_config())
 
     def _normalize_name(self, name):
         return name
 
+    @property
+    def snapshot(self):
+        """The OptionsSnapshot built after the last run_parse_callbacks.
+
+        Use it on hot paths instead of the parser, attribute access on the parser goes
+        through OptionParser.__getattr__. Values set on the parser afterward are not seen.
+        """
+        if self._snapshot is None:
+            raise Error("Options have not been parsed yet")
+        return self._snapshot
+
+    def run_parse_callbacks(self):
+        with self._timer.phase("option parse callbacks"):
+            super().run_parse_callbacks()
+        self.__dict__["_snapshot"] = self._build_snapshot()
+
+    def _build_snapshot(self):
+        names = {opt.snapshot_attribute: name for name, opt in self._options.items()}
+        snapshot_cls = type("OptionsSnapshot", (OptionsSnapshot,), {"__slots__": tuple(names)})
+        snapshot = object.__new__(snapshot_cls)
+        for attribute, name in names.items():
+            value = self._options[name].value()
+            if isinstance(value, list):
+                value = tuple(value)
+            object.__setattr__(snapshot, attribute, value)
+        return snapshot
+
+    def _has_precedence(self, name, source):
+        """Return True if source can set the option, and record it as the option source"""
+        if self._option_sources.get(name, 0) > source:
+            return False
+        self._option_sources[name] = source
+        return True
+
     def parse_command_line(self, args=None, final=True, ignore_undefined=True):
         """Override the original parse commandline to ignore params that are not defined
         """
+        with self._timer.phase("parse command line"):
+            remaining = self._parse_command_line(args, ignore_undefined)
+
+        if final:
+            self.run_parse_callbacks()
+
+        return remaining
+
+    def _parse_command_line(self, args, ignore_undefined):
         if args is None:
             args = sys.argv
         remaining = []
@@ -42,22 +141,44 @@ class CustomOptionParser(OptionParser):
                     value = "true"
                 else:
                     raise Error("Option {0} requires a value".format(name))
+            if not self._has_precedence(name, SOURCE_COMMAND_LINE):
+                continue
             try:
                 option.parse(value)
             except ValueError as e:
                 raise Error("Invalid value for {0} value : {1}".format(name, value))
 
+        return remaining
+
+    def parse_config_file(self, path, final=True, fail_silently=False):
+        """Parse the config file the same way as OptionParser.parse_config_file, options
+        already set from env var or command line are skipped
+        """
+        with self._timer.phase("parse config file {0}".format(path)):
+            try:
+                self._parse_config_file(path)
+            except Exception as e:
+                if not fail_silently:
+                    raise e
+
         if final:
             self.run_parse_callbacks()
 
-        return remaining
-
-    def parse_config_file(self, path, *args, fail_silently=False, **kwargs):
-        try:
-            super().parse_config_file(path, *args, **kwargs)
-        except Exception as e:
-            if not fail_silently:
-                raise e
+    def _parse_config_file(self, path):
+        config = {"__file__": os.path.abspath(path)}
+        with open(path, "rb") as f:
+            exec_in(native_str(f.read()), config, config)
+        for name in config:
+            if name not in self._options or not self._has_precedence(name, SOURCE_CONFIG_FILE):
+                continue
+            option = self._options[name]
+            if option.multiple and not isinstance(config[name], (list, str)):
+                raise Error("Option {0} is required to be a list of {1} or a comma-separated string".format(
+                    name, option.type.__name__))
+            if type(config[name]) is str and (option.type is not str or option.multiple):
+                option.parse(config[name])
+            else:
+                option.set(config[name])
 
     def define(self, name, *args, env_name=None, is_required=False, check=None, **kwargs):
         """Mimic define to provide new functionality
@@ -76,11 +197,22 @@ class CustomOptionParser(OptionParser):
                 if len(values) == 2:
                     return True
                 return False
+
+        The option is available on the snapshot as snapshot_attribute(name), options that
+        would share an attribute raise an Error.
         """
+        attribute = snapshot_attribute(name)
+        if hasattr(OptionsSnapshot, attribute):
+            raise Error("Option {0} conflicts with OptionsSnapshot.{1}".format(name, attribute))
+        for other_name, other in self._options.items():
+            if other_name != name and other.snapshot_attribute == attribute:
+                raise Error("Options {0} and {1} have the same snapshot attribute {2}".format(
+                    other_name, name, attribute))
         super().define(name, *args, **kwargs)
         self._options[name].is_required = is_required
         self._options[name].env_name = env_name or name.upper()
         self._options[name].check = check
+        self._options[name].snapshot_attribute = attribute
 
     def is_valid_config(self, raise_error=True):
         for name, opt in self._options.items():
@@ -99,20 +231,21 @@ class CustomOptionParser(OptionParser):
         return True
 
     def parse_env_var(self, args=None, final=True):
-        """Parse the options from env vars
+        """Parse the options from env vars, values from command line are kept
         """
         if args is None:
             args = os.environ
 
-        for name, opt in self._options.items():
-            if opt.env_name in args:
-                env_value = args.get(opt.env_name)
-                if env_value == "" and opt.type == bool:
-                    env_value = "true"
-                try:
-                    opt.parse(value)
-                except ValueError as e:
-                    raise Error("Invalid value for {0} value : {1}".format(name, value))
+        with self._timer.phase("parse env var"):
+            for name, opt in self._options.items():
+                if opt.env_name in args and self._has_precedence(name, SOURCE_ENV_VAR):
+                    env_value = args.get(opt.env_name)
+                    if env_value == "" and opt.type == bool:
+                        env_value = "true"
+                    try:
+                        opt.parse(env_value)
+                    except ValueError as e:
+                        raise Error("Invalid value for {0} value : {1}".format(name, env_value))
 
         if final:
             self.run_parse_callbacks()
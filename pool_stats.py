@@ -0,0 +1,106 @@
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collect connection pool statistics for every server the client talks to.
+
+    The listener has to be registered when the client is created:
+
+        pool_stats = PoolStatsListener()
+        client = motor.MotorClient(uri, event_listeners=[pool_stats])
+        db = DB(client[name], pool_stats=pool_stats)
+
+    Check outs happen on motor's executor threads, so the start time of a check out
+    is kept per thread and the counters are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {}
+
+    def _server(self, address):
+        stats = self._stats.get(address)
+        if stats is None:
+            stats = self._stats[address] = {
+                "in_use": 0,
+                "max_in_use": 0,
+                "waiting": 0,
+                "max_waiting": 0,
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "total_wait": 0.0,
+                "max_wait": 0.0,
+            }
+        return stats
+
+    def _end_wait(self, address):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        stats = self._server(address)
+        stats["waiting"] = max(stats["waiting"] - 1, 0)
+        if started is None:
+            return stats, 0.0
+        return stats, time.monotonic() - started
+
+    def snapshot(self):
+        """Return a copy of the statistics keyed by "host:port"
+
+        total_wait and max_wait are in seconds, avg_wait is total_wait / checkouts.
+        """
+        with self._lock:
+            result = {}
+            for address, stats in self._stats.items():
+                stats = dict(stats)
+                stats["avg_wait"] = stats["total_wait"] / stats["checkouts"] if stats["checkouts"] else 0.0
+                result["{0}:{1}".format(*address)] = stats
+            return result
+
+    #################### Pool events ####################
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._stats.pop(event.address, None)
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+        with self._lock:
+            stats = self._server(event.address)
+            stats["waiting"] += 1
+            stats["max_waiting"] = max(stats["max_waiting"], stats["waiting"])
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            stats, _ = self._end_wait(event.address)
+            stats["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            stats, waited = self._end_wait(event.address)
+            stats["checkouts"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+            stats["in_use"] += 1
+            stats["max_in_use"] = max(stats["max_in_use"], stats["in_use"])
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            stats = self._server(event.address)
+            stats["in_use"] = max(stats["in_use"] - 1, 0)
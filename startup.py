@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import types
+import threading
+import importlib
+import importlib.util
+import importlib.machinery
+
+
+class StartupTimer(object):
+    """Record how long each startup phase takes, up to the moment the app starts listening.
+
+        with startup_timer.phase("connect db"):
+            ...
+        app.listen(port)
+        startup_timer.finish()
+        logging.info(startup_timer.report())
+
+    The framework does not listen itself, the application calls finish() after listen().
+    Phases entered after finish() are not recorded.
+
+    Phases can be nested. Lazy imports (see lazy_import) and CustomOptionParser parsing are
+    recorded as phases of startup_timer; pass another StartupTimer to the parser to scope it.
+
+    The total is measured from the process start where it is known (Linux /proc), so it
+    includes the interpreter boot and the imports that ran before this module. Elsewhere it
+    is measured from the creation of the timer.
+    """
+
+    def __init__(self, from_process_start=True):
+        now = time.perf_counter()
+        process_age = _process_age() if from_process_start else None
+        self.from_process_start = process_age is not None
+        self.started_at = now - process_age if process_age is not None else now
+        self.finished_at = None
+        self.phases = []  # list of [name, start, end, depth]
+        self._local = threading.local()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def finish(self):
+        """Mark the end of the startup, usually right after listen()"""
+        self.finished_at = time.perf_counter()
+
+    def report(self):
+        """Return the startup timing report as a string"""
+        end = self.finished_at or time.perf_counter()
+        total = end - self.started_at
+        lines = ["Startup took {0:.1f} ms (since {1})".format(total * 1000,
+                "process start" if self.from_process_start else "timer creation")]
+        for name, start, phase_end, depth in self.phases:
+            duration = (phase_end - start) if phase_end is not None else 0.0
+            line = "{0:>9.1f} ms {1:>5.1f}%  {2}{3}".format(duration * 1000,
+                    duration * 100 / total if total else 0.0, "  " * depth, name)
+            if phase_end is None:
+                line += " (not finished)"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class _Phase(object):
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.record = None
+        if self.timer.finished_at is not None:
+            return self
+        depth = getattr(self.timer._local, "depth", 0)
+        self.record = [self.name, time.perf_counter(), None, depth]
+        self.timer.phases.append(self.record)
+        self.timer._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.record is None:
+            return False
+        self.record[2] = time.perf_counter()
+        self.timer._local.depth = self.record[3]
+        return False
+
+
+def _process_age():
+    """Return the seconds since the process started, None if it is not known"""
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the command name, which can contain spaces; starttime is field 22
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+startup_timer = StartupTimer()
+
+
+class _TimedLoader(object):
+    """Loader that records the time spent executing the module in startup_timer.
+
+    Other loader methods (get_resource_reader, get_source, is_package, ...) are forwarded to
+    the wrapped loader, which replaces this one on the module once it is loaded.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        with startup_timer.phase("import {0} (lazy)".format(module.__name__)):
+            self.loader.exec_module(module)
+        module.__spec__.loader = self.loader
+        module.__loader__ = self.loader
+        parent, _, child = module.__spec__.name.rpartition(".")
+        if parent:
+            # set the submodule on its package, as the import system does
+            setattr(importlib.import_module(parent), child, module)
+
+
+def _find_spec(name):
+    """Find the spec of the module without importing it nor its parent packages"""
+    module = sys.modules.get(name)
+    if module is not None:
+        # read the spec without triggering the load of a lazy module
+        return types.ModuleType.__getattribute__(module, "__spec__")
+    parent, _, _ = name.rpartition(".")
+    if not parent:
+        return importlib.util.find_spec(name)
+    parent_spec = _find_spec(parent)
+    if parent_spec is None or parent_spec.submodule_search_locations is None:
+        return None
+    return importlib.machinery.PathFinder.find_spec(name, parent_spec.submodule_search_locations)
+
+
+def lazy_import(name):
+    """Return the module, deferring its execution until the first attribute access.
+
+    name can be a submodule, e.g. "bson.raw_bson", the parent packages are only imported when
+    the submodule is loaded.
+    Raise ImportError if the module cannot be found.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = _find_spec(name)
+    if spec is None:
+        raise ImportError("No module named {0!r}".format(name), name=name)
+    loader = importlib.util.LazyLoader(_TimedLoader(spec.loader))
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent in sys.modules:
+        # the package is already imported, expose the submodule right away
+        setattr(sys.modules[parent], child, module)
+    return module
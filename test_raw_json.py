@@ -0,0 +1,68 @@
+import json
+import datetime
+import uuid
+
+import pytest
+
+pytest.importorskip("dd.defined_dict")
+bson = pytest.importorskip("bson")
+pytest.importorskip("tornado")
+
+from bson.binary import Binary
+from bson.raw_bson import RawBSONDocument
+
+from model import *
+from web import NormalJsonEncoder, RawBsonJsonEncoder
+
+
+class Tag(BaseDocument):
+    label = StringField(store_field="l")
+    added_at = DateTimeField(store_field="a")
+
+
+class Address(BaseDocument):
+    street = StringField(store_field="s")
+    tags = ListField(inner_type=DefinedDictField(model=Tag))
+
+
+class Listing(BaseMongoDocument):
+    title = StringField(store_field="t")
+    colors = ListField(inner_type=StringField(), choices={"red": 1, "blue": 2})
+    address = DefinedDictField(model=Address, store_field="addr")
+    previous_addresses = ListField(inner_type=DefinedDictField(model=Address))
+    posted_at = DateTimeField()
+
+
+def stored_listing():
+    """A listing as it is stored in mongo, after map_to_mongo"""
+    timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5, 6000, tzinfo=datetime.timezone.utc).timestamp()
+    return {
+        "_id": "listing-1",
+        "t": "Flat with a view",
+        "colors": [2, 1],
+        "addr": {"s": "1 Main St", "tags": [{"l": "home", "a": timestamp * 1000000}, {"l": None}]},
+        "previous_addresses": [{"s": None, "tags": []}, {"s": "2 Side St"}],
+        "posted_at": timestamp * 1000000,
+        "updated_at": None,
+        "owner_id": bson.ObjectId("5f0c2a1e9d1b2c3d4e5f6a7b"),
+        "price": bson.Decimal128("1234.50"),
+        "photo": Binary(b"\x00\x01binary"),
+        "token": uuid.UUID("00112233-4455-6677-8899-aabbccddeeff"),
+        "checked_at": datetime.datetime(2020, 1, 2, 3, 4, 5),
+    }
+
+
+def test_raw_json_matches_write_json_of_map_from_mongo():
+    raw = bson.encode(stored_listing())
+
+    decoded = bson.decode(raw)
+    Listing.map_from_mongo(decoded)
+    expected = json.loads(json.dumps([decoded], cls=NormalJsonEncoder))
+
+    encoder = RawBsonJsonEncoder(plan=Listing.from_mongo_plan())
+    actual = json.loads(encoder.encode([RawBSONDocument(raw)]))
+
+    assert actual == expected
+    assert actual[0]["id"] == "listing-1"
+    assert actual[0]["colors"] == ["blue", "red"]
+    assert actual[0]["address"]["tags"][0]["label"] == "home"
@@ -1,12 +1,22 @@
+import json
+import uuid
+import base64
 import logging
+import math
+import struct
+import datetime
 
-import motor
 import tornado.web
 import tornado.gen
 import tornado.ioloop
 import tornado.options
 import tornado.log
 
+from startup import lazy_import
+
+bson = lazy_import("bson")
+raw_bson = lazy_import("bson.raw_bson")
+
 
 #################### Custom Errors ####################
 BAD_REQUEST_BODY = 4000
@@ -45,6 +55,196 @@ class JsonArgumentException(BaseException):
 
     def __init__(self, log_exception=False):
         super().__init__(status_code=400, error_code=BAD_REQUEST_BODY, error_message="Invalid Json Body", level=logging.INFO, log_exception=log_exception)
+
+
+#################### Json Encoders ####################
+class NormalJsonEncoder(json.JSONEncoder):
+    """Json encoder used by write_json and write_raw_json
+
+    datetime                ISO 8601 with the utc offset, naive datetimes are taken as utc
+                            e.g. "2020-01-01T00:00:00+00:00"
+    date                    ISO 8601, e.g. "2020-01-01"
+    ObjectId, UUID          hex string
+    Decimal128              decimal string, e.g. "1.10"
+    bytes, Binary           base64 string
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            if o.tzinfo is None:
+                o = o.replace(tzinfo=datetime.timezone.utc)
+            return o.isoformat()
+        if isinstance(o, datetime.date):
+            return o.isoformat()
+        if isinstance(o, uuid.UUID):
+            return str(o)
+        if isinstance(o, bytes):
+            return base64.b64encode(o).decode("ascii")
+        if isinstance(o, (bson.ObjectId, bson.Decimal128)):
+            return str(o)
+        return super().default(o)
+
+
+class PrettyJsonEncoder(NormalJsonEncoder):
+    pass
+
+
+#################### Raw Bson Encoder ####################
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+class RawBsonJsonEncoder(object):
+    """Encode to json an object that contains RawBSONDocument, reading the bson bytes directly
+    instead of decoding them into dicts first.
+
+    plan                    the plan of the model of the documents (see
+                            MapToMongoMixin.from_mongo_plan). Store fields are renamed and
+                            values converted the same way as map_from_mongo.
+    json_encoder            the json encoder class used for values that are not plain json
+                            (datetime, ObjectId, ...). (default : NormalJsonEncoder)
+    codec_options           the codec options of the collection the documents come from,
+                            used to decode the values that are not plain json (uuid
+                            representation, tz_aware, ...). (default : bson default)
+
+    RawBSONDocument can be at any level of obj, e.g. the result of DB.get_documents or
+    DB.query_via_cursor with return_count=True.
+    """
+
+    def __init__(self, plan=None, json_encoder=None, codec_options=None):
+        self.plan = plan
+        self.json_encoder = json_encoder or NormalJsonEncoder
+        # values are decoded from a small wrapping document, that one must be a dict
+        self.codec_options = (codec_options or bson.DEFAULT_CODEC_OPTIONS).with_options(document_class=dict)
+
+    def encode(self, obj):
+        chunks = []
+        self._encode(obj, chunks)
+        return "".join(chunks)
+
+    def _dumps(self, value):
+        return json.dumps(value, cls=self.json_encoder)
+
+    def _encode(self, obj, chunks):
+        if isinstance(obj, raw_bson.RawBSONDocument):
+            self._encode_document(obj.raw, 0, self.plan, chunks)
+        elif isinstance(obj, dict):
+            chunks.append("{")
+            for i, (key, value) in enumerate(obj.items()):
+                if i:
+                    chunks.append(",")
+                chunks.append(_encode_string(key if isinstance(key, str) else str(key)))
+                chunks.append(":")
+                self._encode(value, chunks)
+            chunks.append("}")
+        elif isinstance(obj, (list, tuple)):
+            chunks.append("[")
+            for i, value in enumerate(obj):
+                if i:
+                    chunks.append(",")
+                self._encode(value, chunks)
+            chunks.append("]")
+        else:
+            chunks.append(self._dumps(obj))
+
+    def _encode_document(self, data, position, plan, chunks, is_array=False):
+        """Encode the bson document (or array) starting at position, return the position after it"""
+        end = position + _INT32.unpack_from(data, position)[0] - 1
+        position += 4
+        chunks.append("[" if is_array else "{")
+        first = True
+        while position < end:
+            element_type = data[position]
+            name_end = data.index(b"\x00", position + 1)
+            if not first:
+                chunks.append(",")
+            first = False
+            if is_array:
+                # arrays share the conversion of the field that holds them
+                convert, inner_plan = plan
+            else:
+                name = data[position + 1:name_end].decode("utf-8")
+                key, convert, inner_plan = name, None, None
+                if plan is not None and name in plan:
+                    key, convert, inner_plan = plan[name]
+                chunks.append(_encode_string(key))
+                chunks.append(":")
+            position = self._encode_value(data, name_end + 1, element_type, convert, inner_plan, chunks)
+        chunks.append("]" if is_array else "}")
+        return end + 1
+
+    def _encode_value(self, data, position, element_type, convert, plan, chunks):
+        if element_type == 0x03:
+            return self._encode_document(data, position, plan, chunks)
+        if element_type == 0x04:
+            return self._encode_document(data, position, (convert, plan), chunks, is_array=True)
+        if element_type == 0x0A:
+            chunks.append("null")
+            return position
+        if convert is not None:
+            value, position = self._decode_value(data, position, element_type)
+            chunks.append(self._dumps(convert(value)))
+            return position
+
+        if element_type == 0x02:
+            length = _INT32.unpack_from(data, position)[0]
+            chunks.append(_encode_string(data[position + 4:position + 3 + length].decode("utf-8")))
+            return position + 4 + length
+        if element_type == 0x10:
+            chunks.append(str(_INT32.unpack_from(data, position)[0]))
+            return position + 4
+        if element_type == 0x12:
+            chunks.append(str(_INT64.unpack_from(data, position)[0]))
+            return position + 8
+        if element_type == 0x01:
+            value = _DOUBLE.unpack_from(data, position)[0]
+            chunks.append(float.__repr__(value) if math.isfinite(value) else json.dumps(value))
+            return position + 8
+        if element_type == 0x08:
+            chunks.append("true" if data[position] else "false")
+            return position + 1
+
+        value, position = self._decode_value(data, position, element_type)
+        chunks.append(self._dumps(value))
+        return position
+
+    def _decode_value(self, data, position, element_type):
+        """Decode a single value with bson, return the value and the position after it"""
+        end = position + self._value_size(data, position, element_type)
+        element = bytes((element_type, 0)) + data[position:end]
+        value = bson.decode(_INT32.pack(len(element) + 5) + element + b"\x00", self.codec_options)[""]
+        return value, end
+
+    @staticmethod
+    def _value_size(data, position, element_type):
+        if element_type in (0x01, 0x09, 0x11, 0x12):
+            return 8
+        if element_type in (0x02, 0x0D, 0x0E):
+            return 4 + _INT32.unpack_from(data, position)[0]
+        if element_type in (0x03, 0x04, 0x0F):
+            return _INT32.unpack_from(data, position)[0]
+        if element_type == 0x05:
+            return 5 + _INT32.unpack_from(data, position)[0]
+        if element_type == 0x07:
+            return 12
+        if element_type == 0x08:
+            return 1
+        if element_type == 0x0B:
+            pattern_end = data.index(b"\x00", position)
+            return data.index(b"\x00", pattern_end + 1) + 1 - position
+        if element_type == 0x0C:
+            return 16 + _INT32.unpack_from(data, position)[0]
+        if element_type == 0x10:
+            return 4
+        if element_type == 0x13:
+            return 16
+        if element_type in (0x06, 0x0A, 0x7F, 0xFF):
+            return 0
+        raise bson.errors.InvalidBSON("Unknown bson type {0:#x}".format(element_type))
+
+
 #################### Base Handler ####################
 class BaseHandler(tornado.web.RequestHandler):
 
@@ -100,6 +300,26 @@ class BaseHandler(tornado.web.RequestHandler):
         self.set_status(status_code)
         self.finish()
 
+    def write_raw_json(self, obj, model=None, codec_options=None, status_code=200):
+        """Write an object that contains RawBSONDocument (from the DB methods with raw=True)
+        as json, without decoding the bson into dicts.
+
+        model                   the model of the documents, its store_field are renamed
+                                and values converted like map_from_mongo
+        codec_options           the codec options of the collection the documents come
+                                from, e.g. db.collection(name, raw=True).codec_options
+        """
+        encoder = RawBsonJsonEncoder(plan=model.from_mongo_plan() if model is not None else None,
+                codec_options=codec_options)
+        output = encoder.encode(obj)
+        if self.has_flag("pretty"):
+            output = json.dumps(json.loads(output), indent=4, separators=(",", ": "))
+        self.write(output)
+
+        self.set_header("Content-Type", "application/json")
+        self.set_status(status_code)
+        self.finish()
+
     def _write_custom_error(self, exception):
         if isinstance(exception, BaseException):
             resp = exception.response